@@ -1,14 +1,18 @@
-from sqlalchemy import create_engine, inspect
+import asyncio
+from sqlalchemy import inspect
 from database import engine  # Import from your existing database.py
 
-def check_tables():
-    inspector = inspect(engine)
-    tables = inspector.get_table_names()
+async def check_tables():
+    # Inspection is sync-only, so run it on the async connection's sync facade
+    async with engine.connect() as conn:
+        tables = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
     print("Existing tables:")
     for table in tables:
         print(f"- {table}")
     
+    # Close pooled connections while the event loop is still running
+    await engine.dispose()
     return tables
 
 if __name__ == "__main__":
-    check_tables()
\ No newline at end of file
+    asyncio.run(check_tables())
\ No newline at end of file
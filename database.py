@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 
@@ -12,13 +12,23 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set")
 
-# Create engine with connection pooling
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True
+# Run on the asyncpg driver; it takes `ssl` where libpq takes `sslmode`
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+if "sslmode" in ASYNC_DATABASE_URL.query:
+    ASYNC_DATABASE_URL = ASYNC_DATABASE_URL.update_query_dict(
+        {"ssl": ASYNC_DATABASE_URL.query["sslmode"]}
+    ).difference_update_query(["sslmode"])
+
+# Create engine with connection pooling. pool_recycle retires connections
+# before Neon's pooler drops them as idle, so the per-checkout SELECT 1 of
+# pool_pre_ping is opt-in via DB_PRE_PING=1.
+engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("DB_POOL_OVERFLOW", "10")),
+    pool_pre_ping=os.getenv("DB_PRE_PING", "0") == "1",
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800"))
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
\ No newline at end of file
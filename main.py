@@ -1,24 +1,58 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from sqlalchemy import func  # Added for case-insensitive search
+from fastapi.responses import ORJSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+from pydantic import TypeAdapter
+from sqlalchemy import and_, bindparam, exists, insert, select
 import logging
 from datetime import datetime
+from contextlib import asynccontextmanager
 import models
+from schemas import (
+    AdminQuestionResponse, AuthRequest, QuestionCreate, QuestionResponse,
+    QuizResult, QuizSubmission, TenantCreate
+)
 from database import SessionLocal, engine
+import base64
 import hashlib
+import hmac
+import bcrypt
+from cachetools import TTLCache
+from redis import asyncio as aioredis
 from dotenv import load_dotenv
 import os
 
 # Load environment variables
 load_dotenv()
 
-# Create tables
-models.Base.metadata.create_all(bind=engine)
+# Shared response cache client, set in lifespan when REDIS_URL is configured
+redis_client: Optional[aioredis.Redis] = None
+
+# Schema is managed by init_db.py (fresh databases) and migrate.py (existing
+# ones); set AUTO_CREATE_TABLES=1 to create missing tables on startup (local
+# development)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("AUTO_CREATE_TABLES") == "1":
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+    
+    # Response cache is shared through Redis so set_questions can invalidate
+    # it for every worker; without REDIS_URL caching is switched off
+    global redis_client
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        redis_client = aioredis.from_url(redis_url)
+    yield
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+    await engine.dispose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,52 +68,128 @@ app.add_middleware(
 )
 
 # Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-# Pydantic models
-class QuestionCreate(BaseModel):
-    question: str
-    answer: bool
+# Helper functions to hash and verify passwords
+BCRYPT_ROUNDS = 12
 
-class QuizSubmission(BaseModel):
-    username: str
-    answers: List[bool]
+def _bcrypt_input(password: str) -> bytes:
+    # bcrypt only looks at the first 72 bytes (newer releases reject longer
+    # input), so feed it a fixed 44-byte base64 SHA-256 digest instead
+    return base64.b64encode(hashlib.sha256(password.encode()).digest())
 
-class AuthRequest(BaseModel):
-    username: str
-    password: str
-    tenant: str
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(_bcrypt_input(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
-class TenantCreate(BaseModel):
-    name: str
-    display_name: str
+def verify_password(password: str, hashed: str) -> bool:
+    # Accounts created before the bcrypt switch still hold unsalted SHA-256 hex digests
+    if not hashed.startswith("$2"):
+        # Still pay for one bcrypt round so login timing doesn't reveal
+        # which accounts hold a legacy hash
+        bcrypt.checkpw(_bcrypt_input(password), DUMMY_PASSWORD_HASH.encode())
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(hashed, legacy)
+    return bcrypt.checkpw(_bcrypt_input(password), hashed.encode())
 
-# Helper function to hash passwords
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+# Checked when the user doesn't exist so both failure paths cost one bcrypt round
+DUMMY_PASSWORD_HASH = hash_password("dummy-password")
+
+# Pack booleans into an int, bit i set when flags[i] is true
+def pack_bits(flags: List[bool]) -> int:
+    return int("".join("1" if f else "0" for f in reversed(flags)) or "0", 2)
+
+# Hot lookups are built once with bind parameters, so every request reuses
+# the same compiled SQL (and asyncpg's per-connection prepared statement)
+_TENANT_STMT = select(models.Tenant.id, models.Tenant.name).where(
+    models.Tenant.name_key == bindparam("t")
+)
+_USER_WITH_TENANT_STMT = select(models.User).join(models.User.tenant).options(
+    contains_eager(models.User.tenant)
+).where(
+    models.Tenant.name_key == bindparam("t"),
+    models.User.username_key == bindparam("u")
+)
+
+# Tenants are rarely created and never renamed, so cache name -> (id, name)
+# in-process instead of querying on every request. Misses are not cached so
+# a tenant created through another worker is visible immediately. Only the
+# event loop touches the cache, so it needs no lock.
+_tenant_cache = TTLCache(maxsize=1024, ttl=300)
+
+async def resolve_tenant(db: AsyncSession, tenant_name: str) -> Optional[Tuple[int, str]]:
+    key = tenant_name.strip().lower()
+    cached = _tenant_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    row = (await db.execute(_TENANT_STMT, {"t": key})).first()
+    if row is None:
+        return None
+    
+    cached = (row.id, row.name)
+    _tenant_cache[key] = cached
+    return cached
+
+# Student question lists are cached server-side only. set_questions writes
+# a tenant's questions once (it refuses if any exist), so a non-empty list
+# never goes stale; empty lists are not cached, which keeps a read racing
+# the admin commit from pinning the old empty list. set_questions still
+# clears the key after committing.
+QUESTIONS_CACHE_TTL = 3600
+
+# Validates rows against the response model and serializes them in one pass
+_QUESTION_LIST = TypeAdapter(List[QuestionResponse])
+
+def questions_cache_key(tenant_name: str) -> str:
+    return f"quiz:questions:{tenant_name.strip().lower()}"
+
+# Redis errors only cost a cache miss, never the request
+async def cache_get(key: str) -> Optional[bytes]:
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(key)
+    except Exception:
+        logger.warning(f"Error retrieving cache key '{key}'", exc_info=True)
+        return None
+
+async def cache_set(key: str, value: bytes, expire: int) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(key, value, ex=expire)
+    except Exception:
+        logger.warning(f"Error setting cache key '{key}'", exc_info=True)
+
+async def cache_delete(key: str) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(key)
+    except Exception:
+        logger.warning(f"Error deleting cache key '{key}'", exc_info=True)
 
 # Health check endpoint
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy"}
 
 # Tenant endpoints
 @app.post("/tenant/create")
-def create_tenant(tenant: TenantCreate, db: Session = Depends(get_db)):
+async def create_tenant(tenant: TenantCreate, db: AsyncSession = Depends(get_db)):
     # Normalize tenant name
     tenant_name = tenant.name.strip().lower()
     
     # Check if tenant already exists (case-insensitive)
-    db_tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant_name
-    ).first()
+    tenant_exists = (await db.execute(
+        select(exists().where(
+            models.Tenant.name_key == tenant_name
+        ))
+    )).scalar()
     
-    if db_tenant:
+    if tenant_exists:
         raise HTTPException(
             status_code=400,
             detail=f"Tenant '{tenant.name}' already exists"
@@ -87,11 +197,13 @@ def create_tenant(tenant: TenantCreate, db: Session = Depends(get_db)):
     
     new_tenant = models.Tenant(
         name=tenant.name.strip(),
+        name_key=tenant_name,
         display_name=tenant.display_name.strip()
     )
     db.add(new_tenant)
-    db.commit()
-    db.refresh(new_tenant)
+    # id comes back from the INSERT; the session doesn't expire on commit,
+    # so no refresh SELECT is needed
+    await db.commit()
     return {
         "message": "Tenant created successfully",
         "tenant_id": new_tenant.id,
@@ -100,112 +212,116 @@ def create_tenant(tenant: TenantCreate, db: Session = Depends(get_db)):
 
 # Tenant verification endpoint
 @app.get("/tenant-check/{tenant_name}")
-def check_tenant(tenant_name: str, db: Session = Depends(get_db)):
-    tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant_name.strip().lower()
-    ).first()
-    return {"exists": tenant is not None}
+async def check_tenant(tenant_name: str, db: AsyncSession = Depends(get_db)):
+    return {"exists": await resolve_tenant(db, tenant_name) is not None}
 
 @app.post("/signup")
-def signup(auth: AuthRequest, db: Session = Depends(get_db)):
+async def signup(auth: AuthRequest, db: AsyncSession = Depends(get_db)):
     # Normalize inputs
     tenant_name = auth.tenant.strip().lower()
     username = auth.username.strip()
     
-    # 1. Find tenant
-    tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant_name
-    ).first()
+    # 1. Find tenant and any same-named user IN THIS SPECIFIC TENANT ONLY
+    # with a single outer join
+    tenant = (await db.execute(
+        select(
+            models.Tenant.id, models.Tenant.name, models.User.id.label("user_id")
+        ).outerjoin(models.User, and_(
+            models.User.tenant_id == models.Tenant.id,  # This is the critical part
+            models.User.username_key == username.lower()
+        )).where(
+            models.Tenant.name_key == tenant_name
+        )
+    )).first()
     
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
+    tenant_id, tenant_display = tenant.id, tenant.name
     
-    # 2. Check if username exists IN THIS SPECIFIC TENANT ONLY
-    existing_user = db.query(models.User).filter(
-        func.lower(models.User.username) == username.lower(),
-        models.User.tenant_id == tenant.id  # This is the critical part
-    ).first()
-    
-    if existing_user:
+    # 2. Reject usernames already taken in this tenant
+    if tenant.user_id is not None:
         raise HTTPException(
             status_code=400,
             detail="Username already exists in this tenant"
         )
     
-    # 3. Create user (same username can exist in other tenants)
+    # 3. Create user (same username can exist in other tenants); bcrypt is
+    # CPU-bound, so keep it off the event loop
     new_user = models.User(
         username=username,
-        password=hash_password(auth.password.strip()),
-        tenant_id=tenant.id
+        username_key=username.lower(),
+        password=await run_in_threadpool(hash_password, auth.password.strip()),
+        tenant_id=tenant_id
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
     
     return {
         "message": "Signup successful",
-        "tenant": tenant.name,
+        "tenant": tenant_display,
         "username": username
     }
 @app.post("/login")
-def login(auth: AuthRequest, db: Session = Depends(get_db)):
+async def login(auth: AuthRequest, db: AsyncSession = Depends(get_db)):
     # Normalize inputs
     tenant_name = auth.tenant.strip().lower()
     username = auth.username.strip()
     
-    # Find tenant
-    tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant_name
-    ).first()
+    # Find user together with its tenant in one SELECT
+    user = (await db.execute(
+        _USER_WITH_TENANT_STMT, {"t": tenant_name, "u": username.lower()}
+    )).scalars().first()
     
-    if not tenant:
+    if not user and await resolve_tenant(db, tenant_name) is None:
         raise HTTPException(
             status_code=404,
             detail="Tenant not found"
         )
     
-    # Find user
-    user = db.query(models.User).filter(
-        func.lower(models.User.username) == username.lower(),
-        models.User.tenant_id == tenant.id
-    ).first()
-    
-    # Verify credentials
-    if not user or user.password != hash_password(auth.password.strip()):
+    # Verify credentials (always run a bcrypt check to keep timing uniform)
+    password = auth.password.strip()
+    stored_hash = user.password if user else DUMMY_PASSWORD_HASH
+    if not await run_in_threadpool(verify_password, password, stored_hash) or not user:
         raise HTTPException(
             status_code=401,
             detail="Invalid credentials"
         )
     
-    logger.info(f"Successful login - Tenant: {tenant.name} | User: {username}")
+    # Upgrade legacy SHA-256 hashes now that we have the plaintext
+    if not user.password.startswith("$2"):
+        user.password = await run_in_threadpool(hash_password, password)
+        await db.commit()
+    
+    logger.info(f"Successful login - Tenant: {user.tenant.name} | User: {username}")
     return {"message": "Login successful"}
 
 # Admin endpoints
 @app.post("/{tenant}/admin/set_questions")
-def set_questions(
+async def set_questions(
     tenant: str,
     payload: Dict[str, List[QuestionCreate]],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Find tenant
-    db_tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant.strip().lower()
-    ).first()
+    db_tenant = await resolve_tenant(db, tenant)
     
     if not db_tenant:
         raise HTTPException(
             status_code=404,
             detail="Tenant not found"
         )
-    
-    # Check for existing questions
-    existing_questions = db.query(models.Question).filter(
-        models.Question.tenant_id == db_tenant.id
-    ).count()
-    
-    if existing_questions > 0:
-        questions = db.query(models.Question).filter(
-            models.Question.tenant_id == db_tenant.id
-        ).all()
+    tenant_id, tenant_display = db_tenant
+    
+    # Check for existing questions (one query, no separate COUNT)
+    questions = (await db.execute(
+        select(
+            models.Question.id, models.Question.question, models.Question.answer
+        ).where(
+            models.Question.tenant_id == tenant_id
+        ).order_by(models.Question.id)
+    )).all()
+    
+    if questions:
         return {
             "message": "Questions already exist for this tenant",
             "questions": [{
@@ -215,114 +331,138 @@ def set_questions(
             } for q in questions]
         }
     
-    # Add new questions
-    for q in payload["questions"]:
-        question = models.Question(
-            question=q.question.strip(),
-            answer=q.answer,
-            tenant_id=db_tenant.id
-        )
-        db.add(question)
-    
-    db.commit()
-    logger.info(f"Admin set questions - Tenant: {db_tenant.name}")
-    return {"message": f"{len(payload['questions'])} questions set for {db_tenant.name}"}
+    # Add new questions in a single executemany
+    rows = [{
+        "question": q.question.strip(),
+        "answer": q.answer,
+        "tenant_id": tenant_id
+    } for q in payload["questions"]]
+    if rows:
+        await db.execute(insert(models.Question), rows)
+    await db.commit()
+    await cache_delete(questions_cache_key(tenant))
+    logger.info(f"Admin set questions - Tenant: {tenant_display}")
+    return {"message": f"{len(payload['questions'])} questions set for {tenant_display}"}
 
 # Student endpoints
-@app.get("/{tenant}/student/questions")
-def get_questions(tenant: str, db: Session = Depends(get_db)):
+@app.get("/{tenant}/student/questions", response_model=List[QuestionResponse])
+async def get_questions(tenant: str, db: AsyncSession = Depends(get_db)):
+    # Clients must revalidate: only the server-side copy is cleared on
+    # set_questions
+    headers = {"Cache-Control": "no-cache"}
+    cache_key = questions_cache_key(tenant)
+    cached = await cache_get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json", headers=headers)
+    
     # Find tenant
-    db_tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant.strip().lower()
-    ).first()
+    db_tenant = await resolve_tenant(db, tenant)
     
     if not db_tenant:
         raise HTTPException(
             status_code=404,
             detail="Tenant not found"
         )
+    tenant_id, _ = db_tenant
     
-    questions = db.query(models.Question).filter(
-        models.Question.tenant_id == db_tenant.id
-    ).all()
+    questions = (await db.execute(
+        select(models.Question.id, models.Question.question).where(
+            models.Question.tenant_id == tenant_id
+        ).order_by(models.Question.id)
+    )).all()
     
-    return [{"id": q.id, "question": q.question} for q in questions]
+    body = _QUESTION_LIST.dump_json(
+        _QUESTION_LIST.validate_python(questions, from_attributes=True)
+    )
+    if questions:
+        await cache_set(cache_key, body, QUESTIONS_CACHE_TTL)
+    return Response(content=body, media_type="application/json", headers=headers)
 # Add this to your FastAPI backend (main.py)
-@app.get("/{tenant}/admin/questions")
-def get_admin_questions(tenant: str, db: Session = Depends(get_db)):
-    db_tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant.strip().lower()
-    ).first()
+@app.get("/{tenant}/admin/questions", response_model=List[AdminQuestionResponse])
+async def get_admin_questions(tenant: str, db: AsyncSession = Depends(get_db)):
+    # Find tenant
+    db_tenant = await resolve_tenant(db, tenant)
     
     if not db_tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
-    
-    questions = db.query(models.Question).filter(
-        models.Question.tenant_id == db_tenant.id
-    ).all()
-    
-    return [{"id": q.id, "question": q.question, "answer": q.answer} for q in questions]
+    tenant_id, _ = db_tenant
+    
+    questions = (await db.execute(
+        select(
+            models.Question.id, models.Question.question, models.Question.answer
+        ).where(
+            models.Question.tenant_id == tenant_id
+        ).order_by(models.Question.id)
+    )).all()
+    
+    # Rows are validated straight into the response model
+    return questions
 
-@app.post("/{tenant}/student/submit")
-def submit_quiz(
+@app.post("/{tenant}/student/submit", response_model=QuizResult)
+async def submit_quiz(
     tenant: str,
     submission: QuizSubmission,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Find tenant
-    db_tenant = db.query(models.Tenant).filter(
-        func.lower(models.Tenant.name) == tenant.strip().lower()
-    ).first()
-    
-    if not db_tenant:
-        raise HTTPException(
-            status_code=404,
-            detail="Tenant not found"
-        )
-    
-    # Find user
-    user = db.query(models.User).filter(
-        func.lower(models.User.username) == submission.username.strip().lower(),
-        models.User.tenant_id == db_tenant.id
-    ).first()
+    # Find user together with its tenant in one SELECT
+    user = (await db.execute(_USER_WITH_TENANT_STMT, {
+        "t": tenant.strip().lower(),
+        "u": submission.username.strip().lower()
+    })).scalars().first()
     
     if not user:
+        if await resolve_tenant(db, tenant) is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Tenant not found"
+            )
         raise HTTPException(
             status_code=404,
             detail="User not found"
         )
+    tenant_id, tenant_display = user.tenant_id, user.tenant.name
+    
+    # Stream answers in question order from a server-side cursor, packing
+    # them into a bitmask (bit i = answer to question i). Questions with no
+    # stored answer can't be answered correctly, so track which ones have one.
+    truth = known = total = 0
+    result = await db.stream(
+        select(models.Question.answer).where(
+            models.Question.tenant_id == tenant_id
+        ).order_by(models.Question.id).execution_options(yield_per=500)
+    )
+    async for chunk in result.scalars().partitions():
+        truth |= pack_bits(chunk) << total
+        known |= pack_bits([a is not None for a in chunk]) << total
+        total += len(chunk)
     
-    # Get questions
-    questions = db.query(models.Question).filter(
-        models.Question.tenant_id == db_tenant.id
-    ).all()
-    
-    if not questions:
+    if not total:
         raise HTTPException(
             status_code=404,
             detail="No questions found for this tenant"
         )
     
-    # Calculate score
-    correct = sum(
-        1 for i, q in enumerate(questions) 
-        if i < len(submission.answers) and q.answer == submission.answers[i]
-    )
+    # Calculate score: matches are the clear bits of truth XOR given, over
+    # the questions actually answered that have a stored answer (extra
+    # answers are ignored)
+    answered = min(len(submission.answers), total)
+    given = pack_bits(submission.answers[:answered])
+    correct = (~(truth ^ given) & known & ((1 << answered) - 1)).bit_count()
     
     # Record submission
     new_submission = models.QuizSubmission(
         answers=submission.answers,
         score=correct,
         user_id=user.id,
-        tenant_id=db_tenant.id
+        tenant_id=tenant_id
     )
     db.add(new_submission)
-    db.commit()
+    await db.commit()
     
-    logger.info(f"Quiz submitted - Tenant: {db_tenant.name} | User: {user.username} | Score: {correct}/{len(questions)}")
+    logger.info(f"Quiz submitted - Tenant: {tenant_display} | User: {user.username} | Score: {correct}/{total}")
     return {
-        "message": f"You scored {correct}/{len(questions)}",
+        "message": f"You scored {correct}/{total}",
         "username": user.username,
         "score": correct,
-        "total": len(questions)
+        "total": total
     }
\ No newline at end of file
@@ -0,0 +1,40 @@
+import asyncio
+from sqlalchemy import text
+from database import engine  # Import from your existing database.py
+
+# Brings a database created from the original models up to the current
+# schema without dropping data (init_db.py recreates every table). Each
+# step is safe to re-run, and the whole script runs in one transaction.
+STEPS = [
+    # Tenant lookups compare against a stored lowercased name
+    "ALTER TABLE tenants ADD COLUMN IF NOT EXISTS name_key VARCHAR",
+    "UPDATE tenants SET name_key = lower(name) WHERE name_key IS NULL",
+    "ALTER TABLE tenants ALTER COLUMN name_key SET NOT NULL",
+    "DROP INDEX IF EXISTS ix_tenants_lower_name",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_tenants_name_key ON tenants (name_key)",
+
+    # Same for usernames; user_tenant_uc moves from (username, tenant_id)
+    # to (tenant_id, username_key)
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS username_key VARCHAR",
+    "UPDATE users SET username_key = lower(username) WHERE username_key IS NULL",
+    "ALTER TABLE users ALTER COLUMN username_key SET NOT NULL",
+    "DROP INDEX IF EXISTS ix_users_tenant_lower_username",
+    "ALTER TABLE users DROP CONSTRAINT IF EXISTS user_tenant_uc",
+    "ALTER TABLE users ADD CONSTRAINT user_tenant_uc UNIQUE (tenant_id, username_key)",
+
+    # Serves WHERE tenant_id = ? ORDER BY id for question lists and scoring
+    "CREATE INDEX IF NOT EXISTS ix_questions_tenant_id ON questions (tenant_id, id)",
+]
+
+async def migrate():
+    # A unique index failing here means two names differ only by case;
+    # rename one and re-run
+    async with engine.begin() as conn:
+        for step in STEPS:
+            print(f"- {step}")
+            await conn.execute(text(step))
+    await engine.dispose()
+    print("✅ Database schema migrated!")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, ARRAY, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, ARRAY, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 
 # SINGLE Base declaration
 Base = declarative_base()
@@ -8,18 +9,24 @@ class Tenant(Base):
     __tablename__ = "tenants"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True)
+    # Lowercased name, set on insert, so lookups are a plain equality
+    name_key = Column(String, unique=True, index=True, nullable=False)
     display_name = Column(String)
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String)
+    # Lowercased username, set on insert, so lookups are a plain equality
+    username_key = Column(String, nullable=False)
     password = Column(String)
     tenant_id = Column(Integer, ForeignKey('tenants.id'))
+    tenant = relationship("Tenant")
     
-    # This ensures username is unique PER TENANT (correct implementation)
+    # This ensures username is unique PER TENANT (case-insensitive) and
+    # backs the username_key lookups
     __table_args__ = (
-        UniqueConstraint('username', 'tenant_id', name='user_tenant_uc'),
+        UniqueConstraint('tenant_id', 'username_key', name='user_tenant_uc'),
     )
 
 class Question(Base):
@@ -28,6 +35,11 @@ class Question(Base):
     question = Column(String)
     answer = Column(Boolean)
     tenant_id = Column(Integer, ForeignKey('tenants.id'))
+    
+    # Serves WHERE tenant_id = ? ORDER BY id straight from the index
+    __table_args__ = (
+        Index('ix_questions_tenant_id', tenant_id, id),
+    )
 
 class QuizSubmission(Base):
     __tablename__ = "quiz_submissions"
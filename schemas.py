@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 
 # ----- Auth Schemas -----
@@ -17,16 +17,24 @@ class QuestionCreate(BaseModel):
     answer: bool
 
 class QuestionResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True, extra='forbid')
+    
     id: int
-    question: str
+    # Both question columns are nullable, so responses pass NULLs through
+    question: Optional[str]
     # answer excluded intentionally (students shouldn't see answers)
 
+class AdminQuestionResponse(QuestionResponse):
+    answer: Optional[bool]
+
 # ----- Quiz Submission Schemas -----
 class QuizSubmission(BaseModel):
     username: str
     answers: List[bool]
 
 class QuizResult(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid')
+    
     message: str
     username: str
     score: int